@@ -2,10 +2,17 @@ import os
 
 os.environ["KMP_DUPLICATE_LIB_OK"] = "TRUE"
 
-from fastapi import FastAPI, UploadFile, File, Form
+from typing import List, Optional
+from fastapi import FastAPI, HTTPException, UploadFile, File, Form
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
+from starlette.background import BackgroundTask
+import asyncio
+import base64
 import io
 import json
+import tempfile
 import numpy as np
 import cv2
 from PIL import Image
@@ -23,22 +30,40 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-generic_detector = ObjectDetector(model_path="models/yolov8s-world.pt")
-personalized_detector = ObjectRecognizer()
-object_scanner = ObjectScanner()
+# "single": all models in this process, "multiprocess": one worker pool per model (see workers.py)
+SERVER_MODE = os.environ.get("SERVER_MODE", "single")
+
+if SERVER_MODE == "multiprocess":
+    from .workers import create_worker_pools
+
+    generic_detector, personalized_detector, object_scanner = create_worker_pools()
+else:
+    generic_detector = ObjectDetector(model_path="models/yolov8s-world.pt")
+    personalized_detector = ObjectRecognizer()
+    object_scanner = ObjectScanner()
+
+
+async def _run_model(fn, *args, **kwargs):
+    # Worker pool calls block until the worker is done, so they are awaited from a
+    # thread and requests for different models run in parallel
+    if SERVER_MODE == "multiprocess":
+        return await run_in_threadpool(fn, *args, **kwargs)
+    return fn(*args, **kwargs)
 
 
 @app.post("/detect")
 async def detect_generic_object(prompt: str = Form(...), file: UploadFile = File(...)):
     contents = await file.read()
     image = Image.open(io.BytesIO(contents))
-    detection = generic_detector.predict(image, prompt)
+    detection = await _run_model(generic_detector.predict, image, prompt)
     return {"detection": detection}
 
 
 @app.post("/detect_personalized")
 async def detect_personalized_object(
-    file: UploadFile = File(...), label: str = Form(...)
+    file: UploadFile = File(...),
+    label: str = Form(...),
+    latency_budget_ms: Optional[int] = Form(None),
 ):
     contents = await file.read()
     image_pil = Image.open(io.BytesIO(contents))
@@ -47,59 +72,158 @@ async def detect_personalized_object(
     image_np = np.array(image_pil)
     image_bgr = cv2.cvtColor(image_np, cv2.COLOR_RGB2BGR)
 
-    detection = personalized_detector.run_identification_cycle(image_bgr, label)
+    if latency_budget_ms:
+        detection, settings = await _run_model(
+            personalized_detector.run_adaptive_identification_cycle,
+            image_bgr,
+            label,
+            latency_budget_ms,
+        )
+        return {"detection": detection, "adaptive": settings}
+
+    detection = await _run_model(
+        personalized_detector.run_identification_cycle, image_bgr, label
+    )
     return {"detection": detection}
 
 
 @app.post("/get_bounding_box_from_coord")
 async def get_bounding_box(
-    x: int = Form(...), y: int = Form(...), file: UploadFile = File(...)
+    x: int = Form(...),
+    y: int = Form(...),
+    file: UploadFile = File(...),
+    debug: bool = Form(False),
 ):
     contents = await file.read()
     image_pil = Image.open(io.BytesIO(contents))
     image_np = np.array(image_pil)
     image_bgr = cv2.cvtColor(image_np, cv2.COLOR_RGB2BGR)
 
-    bounding_box = object_scanner.get_bounding_box_from_sam(image_bgr, x, y)
+    overlay = None
+    if debug:
+        bounding_box, overlay = await _run_model(
+            object_scanner.get_bounding_box_from_sam,
+            image_bgr,
+            x,
+            y,
+            return_overlay=True,
+        )
+    else:
+        bounding_box = await _run_model(
+            object_scanner.get_bounding_box_from_sam, image_bgr, x, y
+        )
     if bounding_box:
         # Convert from [x, y, w, h] to [x1, y1, x2, y2]
         x1, y1, w, h = bounding_box
         bounding_box = [x1, y1, x1 + w, y1 + h]
 
-    return {"bounding_box": bounding_box}
+    response = {"bounding_box": bounding_box}
+    if debug:
+        # Visualization is encoded by the scanner's background writer. It is only a
+        # debug aid, so a failed encode leaves it out instead of failing the request.
+        png = None
+        if overlay:
+            try:
+                png = await asyncio.wrap_future(overlay)
+            except Exception as e:
+                print(f"⚠ Debug overlay failed: {e}")
+        response["overlay"] = (
+            "data:image/png;base64," + base64.b64encode(png).decode() if png else None
+        )
+
+    return response
 
 
 @app.get("/get_personal_object_labels")
 async def get_personal_object_labels():
-    summary = object_scanner.get_object_summary()
+    summary = await _run_model(object_scanner.get_object_summary)
     labels = list(summary.keys())
     return {"labels": labels, "summary": summary}
 
 
-@app.post("/save_to_faiss")
-async def save_to_faiss(
-    bbox: str = Form(...), label: str = Form(...), file: UploadFile = File(...)
-):
-    contents = await file.read()
-    image_pil = Image.open(io.BytesIO(contents))
-    image_np = np.array(image_pil)
-    image_bgr = cv2.cvtColor(image_np, cv2.COLOR_RGB2BGR)
+# Views segmented and embedded per batched forward pass during bulk enrollment
+ENROLL_BATCH_SIZE = 8
 
-    # Convert bbox string to list
-    try:
-        bbox_raw = json.loads(bbox)
-    except:
-        bbox_raw = [int(v) for v in bbox.split(",")]
 
+def _decode_bgr(contents):
+    image_np = np.array(Image.open(io.BytesIO(contents)).convert("RGB"))
+    return cv2.cvtColor(image_np, cv2.COLOR_RGB2BGR)
+
+
+def _to_xywh(bbox_raw):
     # Convert from [x1, y1, x2, y2] to [x, y, w, h]
-    bbox_list = [
+    return [
         bbox_raw[0],
         bbox_raw[1],
         bbox_raw[2] - bbox_raw[0],
         bbox_raw[3] - bbox_raw[1],
     ]
 
-    success = object_scanner.process_and_store(image_bgr, bbox_list, label)
+
+def _parse_bboxes(value):
+    """Parses one or more [x1, y1, x2, y2] boxes into [x, y, w, h] lists.
+
+    Accepts a JSON box, a JSON list of boxes or comma-separated numbers (four per
+    box), and raises a 400 HTTPException for anything else.
+    """
+    try:
+        raw = json.loads(value)
+    except ValueError:
+        try:
+            raw = [int(v) for v in value.split(",")]
+        except ValueError:
+            raw = None
+
+    def is_number(v):
+        return isinstance(v, (int, float)) and not isinstance(v, bool)
+
+    if isinstance(raw, list) and raw and all(is_number(v) for v in raw):
+        raw = [raw[i : i + 4] for i in range(0, len(raw), 4)]
+    if not isinstance(raw, list) or not raw:
+        raise HTTPException(status_code=400, detail=f"Invalid bounding box '{value}'")
+    for box in raw:
+        if not (
+            isinstance(box, list)
+            and len(box) == 4
+            and all(is_number(v) for v in box)
+            and box[2] > box[0]
+            and box[3] > box[1]
+        ):
+            raise HTTPException(
+                status_code=400,
+                detail=f"Invalid bounding box {box}, expected [x1, y1, x2, y2]",
+            )
+    return [_to_xywh(box) for box in raw]
+
+
+def _parse_bbox(value):
+    bboxes = _parse_bboxes(value)
+    if len(bboxes) != 1:
+        raise HTTPException(
+            status_code=400, detail=f"Expected one bounding box, got {len(bboxes)}"
+        )
+    return bboxes[0]
+
+
+def _progress_event(**event):
+    return json.dumps(event) + "\n"
+
+
+@app.post("/save_to_faiss")
+async def save_to_faiss(
+    bbox: str = Form(...), label: str = Form(...), file: UploadFile = File(...)
+):
+    # Convert bbox string to list
+    bbox_list = _parse_bbox(bbox)
+
+    contents = await file.read()
+    image_pil = Image.open(io.BytesIO(contents))
+    image_np = np.array(image_pil)
+    image_bgr = cv2.cvtColor(image_np, cv2.COLOR_RGB2BGR)
+
+    success = await _run_model(
+        object_scanner.process_and_store, image_bgr, bbox_list, label
+    )
     if success:
         object_scanner.save_to_database()
         # Refresh the personalized detector's database
@@ -108,9 +232,129 @@ async def save_to_faiss(
     return {"success": success}
 
 
+async def _enroll_views(views, label, total=None):
+    """Embeds (frame, bbox) views in batches while streaming progress as NDJSON.
+
+    Model calls go through _run_model like in the other endpoints, so in
+    single-process mode they never overlap with other requests. All vectors are
+    added to FAISS at once and the database is saved and reloaded only once.
+    """
+    views = iter(views)
+    features, hists = [], []
+    batch = []
+    done = 0
+    stored = 0
+
+    async def embed_batch():
+        batch_features, batch_hists = await _run_model(
+            object_scanner.embed_views,
+            [frame for frame, _ in batch],
+            [bbox for _, bbox in batch],
+        )
+        features.append(batch_features)
+        hists.append(batch_hists)
+        return len(batch_features)
+
+    try:
+        while True:
+            # Decoding/sampling does not touch the models, so it can run in a thread
+            view = await run_in_threadpool(next, views, None)
+            if view is not None:
+                batch.append(view)
+            if batch and (view is None or len(batch) == ENROLL_BATCH_SIZE):
+                stored += await embed_batch()
+                done += len(batch)
+                batch = []
+                yield _progress_event(
+                    stage="embedding", done=done, total=total, stored=stored
+                )
+            if view is None:
+                break
+
+        if stored > 0:
+            await _run_model(
+                object_scanner.store_features,
+                np.vstack(features),
+                np.vstack(hists),
+                label,
+            )
+            object_scanner.save_to_database()
+            # Refresh the personalized detector's database
+            personalized_detector._load_database()
+    except Exception as e:
+        # The response has already started, so errors are reported in the stream
+        print(f"⚠ Enrollment of '{label}' failed: {e}")
+        yield _progress_event(stage="error", success=False, error=str(e), done=done)
+        return
+
+    yield _progress_event(
+        stage="done",
+        success=stored > 0,
+        total=done,
+        stored=stored,
+        skipped=done - stored,
+    )
+
+
+@app.post("/save_to_faiss_batch")
+async def save_to_faiss_batch(
+    bboxes: str = Form(...),
+    label: str = Form(...),
+    files: List[UploadFile] = File(...),
+):
+    # One [x1, y1, x2, y2] box per uploaded view
+    bbox_list = _parse_bboxes(bboxes)
+    if len(bbox_list) != len(files):
+        raise HTTPException(
+            status_code=400,
+            detail=f"Got {len(files)} files but {len(bbox_list)} bounding boxes",
+        )
+
+    frames = [_decode_bgr(await file.read()) for file in files]
+    return StreamingResponse(
+        _enroll_views(zip(frames, bbox_list), label, total=len(frames)),
+        media_type="application/x-ndjson",
+    )
+
+
+@app.post("/save_video_to_faiss")
+async def save_video_to_faiss(
+    bbox: str = Form(...),
+    label: str = Form(...),
+    max_views: int = Form(20),
+    file: UploadFile = File(...),
+):
+    # Object box in the first frame, tracked through the rest of the video. It is
+    # validated before the upload is spooled, so a bad request leaves no temp file.
+    bbox_list = _parse_bbox(bbox)
+    if max_views <= 0:
+        raise HTTPException(status_code=400, detail="max_views must be positive")
+
+    # OpenCV decodes from a path, so the upload is spooled to a temporary file
+    suffix = os.path.splitext(file.filename or "")[1] or ".mp4"
+    with tempfile.NamedTemporaryFile(suffix=suffix, delete=False) as tmp:
+        tmp.write(await file.read())
+        video_path = tmp.name
+
+    views = (
+        (frame, view_bbox)
+        for _, frame, view_bbox in object_scanner.sample_video_views(
+            video_path, bbox_list, max_views=max_views
+        )
+    )
+
+    # The number of kept views is only known once sampling is done. The temporary
+    # file is removed after the response, even if the client disconnects early.
+    return StreamingResponse(
+        _enroll_views(views, label),
+        media_type="application/x-ndjson",
+        background=BackgroundTask(os.remove, video_path),
+    )
+
+
 @app.post("/delete_personal_object")
 async def delete_personal_object(label: str = Form(...)):
-    success = object_scanner.delete_object(label)
+    success = await _run_model(object_scanner.delete_object, label)
     if success:
         # Refresh the personalized detector's database to reflect changes
         personalized_detector._load_database()
@@ -0,0 +1,328 @@
+import os
+
+os.environ["KMP_DUPLICATE_LIB_OK"] = "TRUE"
+
+import argparse
+import contextlib
+import glob
+import json
+import platform
+import resource
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+import cv2
+import numpy as np
+import torch
+from PIL import Image
+from .detector import ObjectDetector
+from .detector_personalized import ObjectRecognizer
+from .scanner import ObjectScanner
+from .workers import (
+    ObjectDetectorPool,
+    ObjectRecognizerPool,
+    ObjectScannerPool,
+    default_threads,
+    parse_cpu_list,
+)
+
+STAGES = ["detect", "detect_personalized", "bounding_box_from_sam", "process_and_store"]
+# Requests for every read-only pipeline interleaved, as the server sees them under load
+MIXED_STAGE = "mixed"
+MIXED_STAGES = ["detect", "detect_personalized", "bounding_box_from_sam"]
+
+
+def peak_rss_mb(who=resource.RUSAGE_SELF):
+    """Returns the peak RSS of this process (or of its largest child) in MB."""
+    peak = resource.getrusage(who).ru_maxrss
+    # ru_maxrss is reported in bytes on macOS and in kilobytes on Linux
+    if sys.platform == "darwin":
+        return peak / (1024 * 1024)
+    return peak / 1024
+
+
+def summarize(latencies, wall_s=None):
+    """Returns throughput and latency percentiles for a list of durations in seconds.
+
+    With concurrent requests, throughput is computed from the wall-clock time wall_s.
+    """
+    lat_ms = np.array(latencies) * 1000.0
+    total_s = float(wall_s if wall_s is not None else np.sum(latencies))
+    return {
+        "runs": len(latencies),
+        "total_s": round(total_s, 4),
+        "throughput_per_s": round(len(latencies) / total_s, 3) if total_s > 0 else None,
+        "latency_ms": {
+            "mean": round(float(lat_ms.mean()), 2),
+            "min": round(float(lat_ms.min()), 2),
+            "p50": round(float(np.percentile(lat_ms, 50)), 2),
+            "p90": round(float(np.percentile(lat_ms, 90)), 2),
+            "p99": round(float(np.percentile(lat_ms, 99)), 2),
+            "max": round(float(lat_ms.max()), 2),
+        },
+    }
+
+
+def load_frames(pattern):
+    """Loads every image matching the glob pattern as (name, BGR frame, PIL image)."""
+    frames = []
+    for path in sorted(glob.glob(pattern)):
+        frame = cv2.imread(path, cv2.IMREAD_COLOR)
+        if frame is None:
+            print(f"⚠ Skipping unreadable image {path}", file=sys.stderr)
+            continue
+        # Same conversion the API applies to uploaded images
+        image_pil = Image.fromarray(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
+        frames.append((os.path.basename(path), frame, image_pil))
+    return frames
+
+
+def time_requests(requests, warmup, iterations, concurrency=1):
+    """Runs every request (a callable) per iteration, discarding the warmup passes.
+
+    Returns:
+        Tuple (latencies, wall-clock seconds of the timed passes)
+    """
+    for _ in range(warmup):
+        for request in requests:
+            request()
+
+    def timed(request):
+        start = time.perf_counter()
+        request()
+        return time.perf_counter() - start
+
+    wall_start = time.perf_counter()
+    if concurrency > 1:
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            latencies = list(executor.map(timed, requests * iterations))
+    else:
+        latencies = [timed(request) for request in requests * iterations]
+    return latencies, time.perf_counter() - wall_start
+
+
+def git_revision():
+    try:
+        return (
+            subprocess.check_output(
+                ["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL
+            )
+            .decode()
+            .strip()
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmark(args):
+    frames = load_frames(args.images)
+    if not frames:
+        raise FileNotFoundError(f"No images found for pattern '{args.images}'")
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+
+    # The in-process models are not thread-safe, and the single-process server
+    # handles one request at a time, so only the worker pools see concurrent requests
+    concurrency = args.concurrency if args.mode == "multiprocess" else 1
+
+    if args.stages:
+        stages = args.stages.split(",")
+    elif args.mode == "multiprocess":
+        # Enrollment through the worker pools persists to disk, so it is opt-in there
+        stages = MIXED_STAGES + [MIXED_STAGE]
+    else:
+        stages = STAGES + [MIXED_STAGE]
+    report = {
+        "revision": git_revision(),
+        "machine": {
+            "platform": platform.platform(),
+            "python": platform.python_version(),
+            "cpu_count": os.cpu_count(),
+            "torch_threads": torch.get_num_threads(),
+        },
+        "config": {
+            "images": [name for name, _, _ in frames],
+            "prompt": args.prompt,
+            "label": args.label,
+            "device": args.device,
+            "warmup": args.warmup,
+            "iterations": args.iterations,
+            "latency_budget_ms": args.latency_budget_ms,
+            "mode": args.mode,
+            "concurrency": concurrency,
+        },
+        "stages": {},
+    }
+
+    rss_before = peak_rss_mb()
+    load_start = time.perf_counter()
+    if args.mode == "multiprocess":
+
+        def pool_kwargs(cpu_list):
+            cpus = parse_cpu_list(cpu_list)
+            threads = args.threads
+            if threads is None and not cpus:
+                # Unpinned workers split the machine, as in create_worker_pools
+                threads = default_threads(3 * args.workers)
+            return {"size": args.workers, "cpus": cpus, "threads": threads}
+
+        generic_detector = ObjectDetectorPool(
+            args.yolo_model, **pool_kwargs(args.detector_cpus)
+        )
+        personalized_detector = ObjectRecognizerPool(
+            db_folder=args.db_folder,
+            device=args.device,
+            **pool_kwargs(args.recognizer_cpus),
+        )
+        object_scanner = ObjectScannerPool(
+            db_folder=args.db_folder,
+            device=args.device,
+            **pool_kwargs(args.scanner_cpus),
+        )
+        pools = [generic_detector, personalized_detector, object_scanner]
+        for pool in pools:
+            pool.warmup()
+    else:
+        generic_detector = ObjectDetector(model_path=args.yolo_model)
+        personalized_detector = ObjectRecognizer(
+            db_folder=args.db_folder, device=args.device
+        )
+        object_scanner = ObjectScanner(device=args.device, db_folder=args.db_folder)
+        pools = []
+    report["model_load_s"] = round(time.perf_counter() - load_start, 3)
+    report["peak_rss_mb_after_load"] = round(peak_rss_mb(), 1)
+
+    # Click point / enrollment box at the image centre, as in the scanning workflow
+    def centre_bbox(frame):
+        h, w = frame.shape[:2]
+        return [w // 4, h // 4, w // 2, h // 2]
+
+    def identify(frame):
+        if args.latency_budget_ms:
+            return personalized_detector.run_adaptive_identification_cycle(
+                frame, args.label, args.latency_budget_ms
+            )
+        return personalized_detector.run_identification_cycle(frame, args.label)
+
+    stage_fns = {
+        "detect": lambda f: generic_detector.predict(f[2], args.prompt),
+        "detect_personalized": lambda f: identify(f[1]),
+        "bounding_box_from_sam": lambda f: object_scanner.get_bounding_box_from_sam(
+            f[1], f[1].shape[1] // 2, f[1].shape[0] // 2
+        ),
+        # In single mode this only touches the in-memory index, nothing is saved to disk
+        "process_and_store": lambda f: object_scanner.process_and_store(
+            f[1], centre_bbox(f[1]), args.label
+        ),
+    }
+
+    for stage in stages:
+        if stage == MIXED_STAGE:
+            requests = [
+                (lambda fn=stage_fns[name], f=frame: fn(f))
+                for frame in frames
+                for name in MIXED_STAGES
+            ]
+        elif stage in stage_fns:
+            requests = [
+                (lambda fn=stage_fns[stage], f=frame: fn(f)) for frame in frames
+            ]
+        else:
+            raise ValueError(
+                f"Unknown stage '{stage}', expected one of {STAGES + [MIXED_STAGE]}"
+            )
+
+        latencies, wall_s = time_requests(
+            requests, args.warmup, args.iterations, concurrency
+        )
+        result = summarize(latencies, wall_s)
+        result["peak_rss_mb"] = round(peak_rss_mb(), 1)
+        report["stages"][stage] = result
+
+    report["peak_rss_mb"] = round(peak_rss_mb(), 1)
+    report["peak_rss_mb_before_load"] = round(rss_before, 1)
+
+    if pools:
+        for pool in pools:
+            pool.shutdown()
+        # Largest peak RSS of any worker process, available once they have exited
+        report["peak_rss_mb_worker_max"] = round(
+            peak_rss_mb(resource.RUSAGE_CHILDREN), 1
+        )
+    return report
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Replay recorded frames through every server pipeline and report "
+        "throughput, latency percentiles and peak RSS as JSON."
+    )
+    parser.add_argument(
+        "--images", default="multi_view/*.png", help="Glob of input frames"
+    )
+    parser.add_argument("--prompt", default="cup", help="YOLO-World prompt for /detect")
+    parser.add_argument(
+        "--label",
+        default="cup",
+        help="Personal object label for recognition/enrollment",
+    )
+    parser.add_argument(
+        "--stages",
+        default=None,
+        help=f"Comma-separated subset of {STAGES + [MIXED_STAGE]}",
+    )
+    parser.add_argument(
+        "--mode",
+        choices=["single", "multiprocess"],
+        default="single",
+        help="Run the models in this process or in one worker pool per model",
+    )
+    parser.add_argument(
+        "--concurrency", type=int, default=1, help="Requests in flight at the same time"
+    )
+    parser.add_argument("--workers", type=int, default=1, help="Workers per model pool")
+    parser.add_argument("--detector-cpus", default=None, help='CPU list, e.g. "0-3"')
+    parser.add_argument("--recognizer-cpus", default=None, help='CPU list, e.g. "4-7"')
+    parser.add_argument("--scanner-cpus", default=None, help='CPU list, e.g. "8-11"')
+    parser.add_argument(
+        "--warmup", type=int, default=1, help="Untimed passes per stage"
+    )
+    parser.add_argument(
+        "--iterations", type=int, default=3, help="Timed passes per stage"
+    )
+    parser.add_argument(
+        "--latency-budget-ms",
+        type=int,
+        default=None,
+        help="Run detect_personalized in adaptive mode with this budget",
+    )
+    parser.add_argument("--device", default="cpu")
+    parser.add_argument(
+        "--threads", type=int, default=None, help="torch intra-op threads"
+    )
+    parser.add_argument("--db-folder", default="faiss_db")
+    parser.add_argument("--yolo-model", default="models/yolov8s-world.pt")
+    parser.add_argument(
+        "--output", default=None, help="Also write the JSON report here"
+    )
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    # Model logging goes to stderr so stdout carries only the JSON report
+    with contextlib.redirect_stdout(sys.stderr):
+        report = run_benchmark(args)
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    print(output)
+
+
+if __name__ == "__main__":
+    main()
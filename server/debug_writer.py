@@ -0,0 +1,61 @@
+import os
+import queue
+import threading
+from concurrent.futures import Future
+import cv2
+
+
+class DebugImageWriter:
+    """Encodes (and optionally saves) debug visualizations on a background thread.
+
+    Requests only pay for enqueueing the image. When the queue is full the image
+    is dropped instead of blocking the request.
+    """
+
+    def __init__(self, max_queue=4):
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.dropped = 0
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def submit(self, image, output_path=None):
+        """Queues a BGR image for PNG encoding.
+
+        Args:
+            image: BGR image, must not be modified by the caller afterwards
+            output_path: Optional path to also write the PNG to
+
+        Returns:
+            Future resolving to the PNG bytes, or None if the queue is full
+        """
+        future = Future()
+        try:
+            self.queue.put_nowait((image, output_path, future))
+        except queue.Full:
+            self.dropped += 1
+            print(f"⚠ Debug writer queue full, dropped image ({self.dropped} total)")
+            return None
+        return future
+
+    def _run(self):
+        while True:
+            image, output_path, future = self.queue.get()
+            try:
+                ok, encoded = cv2.imencode(".png", image)
+                if not ok:
+                    raise ValueError("PNG encoding failed")
+                png = encoded.tobytes()
+
+                if output_path:
+                    # Write to a temporary file first so readers never see a partial image
+                    tmp_path = f"{output_path}.tmp"
+                    with open(tmp_path, "wb") as f:
+                        f.write(png)
+                    os.replace(tmp_path, output_path)
+                    print(f"✓ Segmentation result saved to {output_path}")
+
+                future.set_result(png)
+            except Exception as e:
+                future.set_exception(e)
+            finally:
+                self.queue.task_done()
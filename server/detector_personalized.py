@@ -9,6 +9,7 @@ import os
 from transformers import AutoImageProcessor, AutoModel
 from PIL import Image
 from ultralytics import FastSAM
+from .histograms import color_histogram, histogram_similarity, load_histograms
 
 
 # Initialize the Object Recognizer with FAISS database
@@ -47,6 +48,20 @@ class ObjectRecognizer:
         self.REID_INTERVAL = 2.0  # seconds between re-ID attempts
         self.last_reid_time = 0
 
+        # Adaptive mode: candidate FastSAM sizes (best quality first) and mask budget
+        self.ADAPTIVE_IMGSZ = [640, 512, 416, 320]
+        self.MIN_EMBED_MASKS = 3  # smallest useful number of masks to embed per cycle
+        self.MAX_EMBED_MASKS = 8  # never embed more masks than this in adaptive mode
+        self.RETINA_OVERHEAD = 1.3  # relative FastSAM cost of retina_masks=True
+        self.MIN_MASK_SIZE = 30  # same size filter as identify_object, in frame pixels
+
+        # Adaptive mode latency estimates, refined with an EMA after every cycle
+        self.fastsam_sec_per_px = 0.5 / (640 * 640)  # FastSAM seconds per input pixel
+        self.embed_sec = 0.05  # seconds per embedded mask (DINOv2 + FAISS search)
+        self.LATENCY_EMA = 0.3
+        # The first cycle includes model warm-up, so it is not used for the estimates
+        self.adaptive_cycles = 0
+
     # Load FAISS database and object mappings: do in jscript?
     def _load_database(self):
         index_path = os.path.join(self.db_folder, "index.faiss")
@@ -66,6 +81,9 @@ class ObjectRecognizer:
         with open(map_path, "r") as f:
             self.id_to_name = json.load(f)
 
+        # Colour histograms of the stored views, used to rank masks in adaptive mode
+        self.id_to_hist = load_histograms(self.db_folder, len(self.id_to_name))
+
         print(f"✓ Loaded database from {self.db_folder}")
         print(f"  - Total feature vectors: {self.index.ntotal}")
         unique_objects = set(self.id_to_name)
@@ -170,26 +188,49 @@ class ObjectRecognizer:
         masks_tensor = masks_obj.data
         print(f"  FastSAM masks found: {masks_tensor.shape[0]}")
 
+        # Check each mask against the database
+        masks = (
+            masks_tensor[i].detach().cpu().numpy().astype(bool)
+            for i in range(masks_tensor.shape[0])
+        )
+        best_match, _ = self._find_best_match(frame, masks, target_label)
+
+        print(
+            f"  Total identification time: {time.time() - total_start:.3f}s"
+        )  # delete later
+
+        self._report_match(best_match, target_label)
+        return best_match
+
+    # Run identify_object on each mask and keep the most confident match
+    def _find_best_match(self, frame, masks, target_label, deadline=None):
+        """Identifies frame-sized boolean masks (any iterable, consumed lazily).
+
+        Returns:
+            Tuple (best match or None, number of masks checked). With a deadline
+            (time.time() value), checking stops once it passes, after at least one mask.
+        """
         best_match = None  # closeest match across all masks
         best_score = 0  # highest score across all masks
+        checked = 0
 
-        # Check each mask against the database
-        for i in range(masks_tensor.shape[0]):
-            mask = masks_tensor[i].detach().cpu().numpy().astype(bool)
+        for mask in masks:
+            if deadline is not None and checked > 0 and time.time() > deadline:
+                break
 
             # Calls identify_object to check this mask
             result = self.identify_object(frame, mask, target_label)
+            checked += 1
 
             # Update the best match if the result is bigger than threshold and more confident than previous best
             if result and result["score"] > best_score:
                 best_score = result["score"]
                 best_match = result
 
-        print(
-            f"  Total identification time: {time.time() - total_start:.3f}s"
-        )  # delete later
+        return best_match, checked
 
-        # Final output check
+    # Final output check
+    def _report_match(self, best_match, target_label):
         if best_match:  # if we found a match with sufficient score
             print(
                 f"  Best match: '{best_match['label']}' (score={best_match['score']:.3f})"
@@ -197,7 +238,184 @@ class ObjectRecognizer:
         else:  # otherwise no match found, run id cycle again later
             print(f"  No match found for '{target_label}'")
 
-        return best_match
+    # Pick FastSAM size, retina masks and number of embedded masks for the budget
+    def _choose_adaptive_settings(self, latency_budget):
+        # Best to cheapest quality, retina masks only make sense at full size
+        configs = [(self.ADAPTIVE_IMGSZ[0], True)] + [
+            (imgsz, False) for imgsz in self.ADAPTIVE_IMGSZ
+        ]
+        for imgsz, retina in configs:
+            fastsam_cost = self.fastsam_sec_per_px * imgsz * imgsz
+            if retina:
+                fastsam_cost *= self.RETINA_OVERHEAD
+            num_embed = int((latency_budget - fastsam_cost) / self.embed_sec)
+            if num_embed >= self.MIN_EMBED_MASKS:
+                return imgsz, retina, min(num_embed, self.MAX_EMBED_MASKS)
+
+        # Nothing fits: run the cheapest configuration with the minimum mask budget
+        return self.ADAPTIVE_IMGSZ[-1], False, self.MIN_EMBED_MASKS
+
+    # Region of the letterboxed FastSAM mask covering the frame (as in scale_image)
+    def _update_latency_estimate(self, estimate, observed):
+        """Moves a latency estimate towards an observed value with an EMA.
+
+        Observations from the first cycle are ignored, and later ones are capped at
+        twice the estimate so a single slow call does not shrink the next cycles.
+        """
+        if self.adaptive_cycles == 0:
+            return estimate
+        observed = min(observed, 2 * estimate)
+        return estimate + self.LATENCY_EMA * (observed - estimate)
+
+    def _mask_frame_region(self, frame_shape, mask_shape):
+        frame_h, frame_w = frame_shape[:2]
+        mask_h, mask_w = mask_shape
+        gain = min(mask_h / frame_h, mask_w / frame_w)
+        pad_x = (mask_w - frame_w * gain) / 2
+        pad_y = (mask_h - frame_h * gain) / 2
+        return gain, int(pad_y), int(pad_x), int(mask_h - pad_y), int(mask_w - pad_x)
+
+    # Score masks with cheap priors: area, centre distance, colour similarity
+    def _rank_masks(self, frame, masks, target_label):
+        gain, top, left, bottom, right = self._mask_frame_region(
+            frame.shape, masks.shape[1:]
+        )
+        masks = masks[:, top:bottom, left:right]
+        num_masks, h, w = masks.shape
+
+        # Bounding boxes, areas and centroids of all masks at once
+        rows = masks.any(axis=2)
+        cols = masks.any(axis=1)
+        y1, y2 = rows.argmax(axis=1), h - 1 - rows[:, ::-1].argmax(axis=1)
+        x1, x2 = cols.argmax(axis=1), w - 1 - cols[:, ::-1].argmax(axis=1)
+        row_counts = masks.sum(axis=2)
+        area_px = row_counts.sum(axis=1)
+
+        # Same small-object filter as identify_object, measured in frame pixels
+        keep = (
+            (area_px > 0)
+            & ((x2 - x1) / gain >= self.MIN_MASK_SIZE)
+            & ((y2 - y1) / gain >= self.MIN_MASK_SIZE)
+        )
+
+        safe_area = np.maximum(area_px, 1)
+        cy = (row_counts * np.arange(h)).sum(axis=1) / safe_area
+        cx = (masks.sum(axis=1) * np.arange(w)).sum(axis=1) / safe_area
+        centre_dist = np.hypot(cx / w - 0.5, cy / h - 0.5) / np.hypot(0.5, 0.5)
+        centre_score = 1.0 - centre_dist
+
+        # Objects covering >= 5% of the frame score fully, background-sized masks 0
+        area_frac = area_px / float(h * w)
+        area_score = np.where(area_frac > 0.5, 0.0, np.minimum(area_frac / 0.05, 1.0))
+
+        target_hists = self.id_to_hist[
+            [i for i, name in enumerate(self.id_to_name) if name == target_label]
+        ]
+        target_hists = target_hists[target_hists.sum(axis=1) > 0]
+        if len(target_hists) == 0:
+            return 0.5 * area_score + 0.5 * centre_score, keep
+
+        small_frame = cv2.resize(frame, (w, h), interpolation=cv2.INTER_AREA)
+        hist_score = np.zeros(num_masks)
+        for i in np.flatnonzero(keep):
+            hist = color_histogram(small_frame, masks[i])
+            hist_score[i] = histogram_similarity(hist, target_hists)
+
+        return 0.25 * area_score + 0.25 * centre_score + 0.5 * hist_score, keep
+
+    # Map a FastSAM mask back to frame resolution (no-op for retina masks)
+    def _mask_to_frame(self, mask, frame_shape):
+        _, top, left, bottom, right = self._mask_frame_region(frame_shape, mask.shape)
+        mask = mask[top:bottom, left:right]
+        if mask.shape == tuple(frame_shape[:2]):
+            return mask
+        resized = cv2.resize(
+            mask.astype(np.uint8),
+            (frame_shape[1], frame_shape[0]),
+            interpolation=cv2.INTER_NEAREST,
+        )
+        return resized.astype(bool)
+
+    # Identification cycle sized to fit a latency budget, also returns the settings
+    def run_adaptive_identification_cycle(self, frame, target_label, latency_budget_ms):
+        print(
+            f"\nSearching for '{target_label}' using adaptive FastSAM + FAISS "
+            f"(budget {latency_budget_ms}ms)..."
+        )
+
+        total_start = time.time()
+        latency_budget = latency_budget_ms / 1000.0
+        imgsz, retina, max_embed = self._choose_adaptive_settings(latency_budget)
+
+        settings = {
+            "latency_budget_ms": latency_budget_ms,
+            "imgsz": imgsz,
+            "retina_masks": retina,
+            "max_embedded_masks": max_embed,
+            "masks_found": 0,
+            "masks_embedded": 0,
+            "masks_dropped_small": 0,
+            "masks_dropped_budget": 0,
+        }
+
+        # Run FastSAM at the chosen size and refine the per-pixel cost estimate
+        t_fastsam = time.time()
+        results = self.fastsam(
+            frame,
+            device=self.device,
+            imgsz=imgsz,
+            conf=0.4,
+            iou=0.9,
+            retina_masks=retina,
+        )
+        fastsam_time = time.time() - t_fastsam
+        observed = fastsam_time / (
+            imgsz * imgsz * (self.RETINA_OVERHEAD if retina else 1.0)
+        )
+        self.fastsam_sec_per_px = self._update_latency_estimate(
+            self.fastsam_sec_per_px, observed
+        )
+        print(f"  FastSAM time: {fastsam_time:.3f}s (imgsz={imgsz}, retina={retina})")
+
+        masks_obj = results[0].masks
+        if masks_obj is None:
+            print("  No masks found")
+            self.adaptive_cycles += 1
+            settings["elapsed_ms"] = round((time.time() - total_start) * 1000, 1)
+            return None, settings
+
+        masks = masks_obj.data.detach().cpu().numpy().astype(bool)
+        settings["masks_found"] = int(masks.shape[0])
+
+        # Only the highest ranked masks get embedded
+        scores, keep = self._rank_masks(frame, masks, target_label)
+        candidates = np.flatnonzero(keep)
+        ranked = candidates[np.argsort(-scores[candidates], kind="stable")]
+        settings["masks_dropped_small"] = int(masks.shape[0] - len(candidates))
+
+        # Stop once the budget is spent, but always embed at least one mask
+        t_embed = time.time()
+        best_match, settings["masks_embedded"] = self._find_best_match(
+            frame,
+            (self._mask_to_frame(masks[i], frame.shape) for i in ranked[:max_embed]),
+            target_label,
+            deadline=total_start + latency_budget,
+        )
+
+        if settings["masks_embedded"] > 0:
+            observed = (time.time() - t_embed) / settings["masks_embedded"]
+            self.embed_sec = self._update_latency_estimate(self.embed_sec, observed)
+
+        settings["masks_dropped_budget"] = len(candidates) - settings["masks_embedded"]
+        settings["elapsed_ms"] = round((time.time() - total_start) * 1000, 1)
+        print(
+            f"  Embedded {settings['masks_embedded']}/{settings['masks_found']} masks, "
+            f"total identification time: {time.time() - total_start:.3f}s"
+        )
+
+        self.adaptive_cycles += 1
+        self._report_match(best_match, target_label)
+        return best_match, settings
 
     # Webcam loop for recognition
     """
@@ -0,0 +1,55 @@
+import os
+import cv2
+import numpy as np
+
+# HSV histogram layout shared by the scanner (stored views) and recognizer (masks)
+HIST_BINS = [16, 8]
+HIST_SIZE = HIST_BINS[0] * HIST_BINS[1]
+
+
+def color_histogram(image_bgr, mask=None):
+    """Computes an L1-normalized hue/saturation histogram of the (masked) image.
+
+    Args:
+        image_bgr: Image in BGR format
+        mask: Optional boolean or uint8 mask with the same height/width as the image
+
+    Returns:
+        float32 array of length HIST_SIZE (all zeros if the mask is empty)
+    """
+    hsv = cv2.cvtColor(image_bgr, cv2.COLOR_BGR2HSV)
+    if mask is not None:
+        mask = mask.astype(np.uint8)
+    hist = cv2.calcHist([hsv], [0, 1], mask, HIST_BINS, [0, 180, 0, 256])
+    hist = hist.flatten().astype("float32")
+    total = hist.sum()
+    if total > 0:
+        hist /= total
+    return hist
+
+
+def histogram_similarity(hist, stored_hists):
+    """Returns the best Bhattacharyya coefficient (0..1) of hist to any stored one."""
+    if stored_hists is None or len(stored_hists) == 0:
+        return 0.0
+    return float(np.sqrt(stored_hists * hist[None, :]).sum(axis=1).max())
+
+
+def load_histograms(db_folder, count):
+    """Loads the colour histograms of the stored views from hists.npy.
+
+    Args:
+        db_folder: FAISS database folder
+        count: Number of stored views (entries in map.json)
+
+    Returns:
+        float32 array of shape (count, HIST_SIZE), with zero rows if the file is
+        missing or does not match the database
+    """
+    hist_path = os.path.join(db_folder, "hists.npy")
+    if os.path.exists(hist_path):
+        hists = np.load(hist_path).astype("float32")
+        if hists.shape == (count, HIST_SIZE):
+            return hists
+        print("⚠ Colour histograms do not match the database, ignoring them")
+    return np.zeros((count, HIST_SIZE), dtype="float32")
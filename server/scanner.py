@@ -3,11 +3,29 @@ import numpy as np
 import torch
 import os
 import json
+import time
 import faiss
 from PIL import Image
 from transformers import AutoImageProcessor, AutoModel
 from sam2.build_sam import build_sam2
 from sam2.sam2_image_predictor import SAM2ImagePredictor
+from .debug_writer import DebugImageWriter
+from .histograms import HIST_SIZE, color_histogram, load_histograms
+
+# Written after all database files, so other processes know when a save is complete
+DB_VERSION_FILE = "version"
+DB_VERSION_SAVING = "saving"
+
+
+def _clamp_box(box, frame_shape, min_size=2):
+    """Clamps an (x, y, w, h) box to the frame, None if less than min_size remains."""
+    frame_h, frame_w = frame_shape[:2]
+    x1, y1 = max(int(box[0]), 0), max(int(box[1]), 0)
+    x2 = min(int(box[0] + box[2]), frame_w)
+    y2 = min(int(box[1] + box[3]), frame_h)
+    if x2 - x1 < min_size or y2 - y1 < min_size:
+        return None
+    return x1, y1, x2 - x1, y2 - y1
 
 
 class ObjectScanner:
@@ -33,6 +51,9 @@ class ObjectScanner:
             self.device
         )
 
+        # Background encoder/writer for optional segmentation visualizations
+        self.debug_writer = DebugImageWriter()
+
         # 2. Initialize or Load FAISS
         self.dimension = 384
         self.load_or_create_database()
@@ -48,6 +69,7 @@ class ObjectScanner:
             self.index = faiss.read_index(index_path)
             with open(map_path, "r") as f:
                 self.id_to_name = json.load(f)
+            self.id_to_hist = load_histograms(self.db_folder, len(self.id_to_name))
 
             print(f"✓ Loaded existing database from {self.db_folder}")
             print(f"  - Total feature vectors: {self.index.ntotal}")
@@ -62,6 +84,7 @@ class ObjectScanner:
             # Create new database
             self.index = faiss.IndexFlatL2(self.dimension)
             self.id_to_name = []
+            self.id_to_hist = np.zeros((0, HIST_SIZE), dtype="float32")
             print(f"✓ Created new empty database (will save to {self.db_folder})")
 
     def get_object_summary(self):
@@ -69,12 +92,55 @@ class ObjectScanner:
         unique_objects = sorted(list(set(self.id_to_name)))
         return {obj: self.id_to_name.count(obj) for obj in unique_objects}
 
+    # Write a database file via a temporary file, so readers never see it half-written
+    def _write_atomic(self, filename, write):
+        path = os.path.join(self.db_folder, filename)
+        tmp_path = f"{path}.tmp"
+        write(tmp_path)
+        os.replace(tmp_path, path)
+
+    def _read_version(self):
+        version_path = os.path.join(self.db_folder, DB_VERSION_FILE)
+        if not os.path.exists(version_path):
+            return None
+        with open(version_path) as f:
+            return f.read()
+
+    def _write_version(self, version):
+        def write(path):
+            with open(path, "w") as f:
+                f.write(version)
+
+        self._write_atomic(DB_VERSION_FILE, write)
+
     # Function to save FAISS index and mapping in json
     def save_to_database(self):
+        def write_map(path):
+            with open(path, "w") as f:
+                json.dump(self.id_to_name, f, indent=4)
+
+        def write_hists(path):
+            with open(path, "wb") as f:
+                np.save(f, self.id_to_hist)
+
         os.makedirs(self.db_folder, exist_ok=True)
-        faiss.write_index(self.index, os.path.join(self.db_folder, "index.faiss"))
-        with open(os.path.join(self.db_folder, "map.json"), "w") as f:
-            json.dump(self.id_to_name, f, indent=4)
+        previous_version = self._read_version()
+        self._write_version(DB_VERSION_SAVING)
+        try:
+            self._write_atomic(
+                "index.faiss", lambda p: faiss.write_index(self.index, p)
+            )
+            self._write_atomic("map.json", write_map)
+            self._write_atomic("hists.npy", write_hists)
+        except BaseException:
+            # Other processes keep the database they have loaded instead of
+            # waiting for this save or reloading a partially written one
+            if previous_version is None:
+                os.remove(os.path.join(self.db_folder, DB_VERSION_FILE))
+            else:
+                self._write_version(previous_version)
+            raise
+        self._write_version(str(time.time_ns()))
 
         print(f"✓ Database saved to {self.db_folder}")
         summary = self.get_object_summary()
@@ -103,11 +169,43 @@ class ObjectScanner:
 
         self.index = new_index
         self.id_to_name = [self.id_to_name[i] for i in indices_to_keep]
+        self.id_to_hist = self.id_to_hist[indices_to_keep]
 
         print(f"✓ Deleted all entries for object '{label}'")
         self.save_to_database()
         return True
 
+    # Crop the masked object on white background, returns (crop, histogram) or None
+    def _crop_object(self, frame, mask):
+        y_idx, x_idx = np.where(mask)
+        if len(y_idx) == 0:
+            return None
+        obj_crop = frame[y_idx.min() : y_idx.max(), x_idx.min() : x_idx.max()].copy()
+        mask_crop = mask[y_idx.min() : y_idx.max(), x_idx.min() : x_idx.max()]
+        if obj_crop.size == 0:
+            return None
+        obj_crop[~mask_crop] = 255
+        return obj_crop, color_histogram(obj_crop, mask_crop)
+
+    # Extract normalized DINOv2 vectors for a list of crops in one batched forward
+    def extract_features(self, crops):
+        inputs = self.dino_processor(
+            images=[Image.fromarray(cv2.cvtColor(c, cv2.COLOR_BGR2RGB)) for c in crops],
+            return_tensors="pt",
+        ).to(self.device)
+        with torch.no_grad():
+            outputs = self.dino_model(**inputs)
+            feat = torch.nn.functional.normalize(
+                outputs.last_hidden_state[:, 0, :], p=2, dim=-1
+            )
+        return feat.cpu().numpy().astype("float32")
+
+    # Add feature vectors (one per view) of an object to the in-memory FAISS index
+    def store_features(self, features, hists, label):
+        self.index.add(features)
+        self.id_to_name.extend([label] * len(features))
+        self.id_to_hist = np.vstack([self.id_to_hist, hists])
+
     # Function to process frame, extract object and store features and object name in FAISS
     def process_and_store(self, frame, bbox, label):
         # Get Mask
@@ -122,37 +220,179 @@ class ObjectScanner:
         mask = masks[0].astype(bool)
 
         # Crop & White Background
-        y_idx, x_idx = np.where(mask)
-        if len(y_idx) == 0:
+        cropped = self._crop_object(frame, mask)
+        if cropped is None:
             return False
-        obj_crop = frame[y_idx.min() : y_idx.max(), x_idx.min() : x_idx.max()].copy()
-        mask_crop = mask[y_idx.min() : y_idx.max(), x_idx.min() : x_idx.max()]
-        obj_crop[~mask_crop] = 255
+        obj_crop, hist = cropped
 
-        # Extract Vector
-        inputs = self.dino_processor(
-            images=Image.fromarray(cv2.cvtColor(obj_crop, cv2.COLOR_BGR2RGB)),
-            return_tensors="pt",
-        ).to(self.device)
-        with torch.no_grad():
-            outputs = self.dino_model(**inputs)
-            feat = torch.nn.functional.normalize(
-                outputs.last_hidden_state[:, 0, :], p=2, dim=-1
+        # Extract Vector and store in FAISS
+        feat_np = self.extract_features([obj_crop])
+        self.store_features(feat_np, hist[None, :], label)
+        return True
+
+    def embed_views(self, frames, bboxes):
+        """Segments and embeds several views of one object with batched model calls.
+
+        Args:
+            frames: List of BGR frames
+            bboxes: List of (x, y, w, h) boxes around the object, one per frame
+
+        Returns:
+            Tuple (features, hists) with one row per successfully segmented view
+        """
+        # SAM2 on all frames at once, prompted with the center of each box
+        self.predictor.set_image_batch(
+            [cv2.cvtColor(frame, cv2.COLOR_BGR2RGB) for frame in frames]
+        )
+        points = [np.array([[x + w // 2, y + h // 2]]) for x, y, w, h in bboxes]
+        masks_batch, _, _ = self.predictor.predict_batch(
+            point_coords_batch=points,
+            point_labels_batch=[np.array([1])] * len(points),
+            multimask_output=True,
+        )
+
+        crops, hists = [], []
+        for frame, masks in zip(frames, masks_batch):
+            cropped = self._crop_object(frame, masks[0].astype(bool))
+            if cropped is not None:
+                crops.append(cropped[0])
+                hists.append(cropped[1])
+
+        if not crops:
+            return (
+                np.zeros((0, self.dimension), dtype="float32"),
+                np.zeros((0, HIST_SIZE), dtype="float32"),
             )
-            feat_np = feat.cpu().numpy().astype("float32")
+        return self.extract_features(crops), np.stack(hists)
 
-        # STORE IN FAISS
-        self.index.add(feat_np)
-        self.id_to_name.append(label)
-        return True
+    @staticmethod
+    def sample_video_views(video_path, bbox, max_views=20, min_difference=12.0):
+        """Tracks the object through a video and yields only visually distinct views.
+
+        A frame is kept when the tracked object crop differs from every view kept
+        so far (mean absolute difference of 32x32 grayscale thumbnails), so
+        redundant frames of a static or slowly moving camera are skipped.
+
+        Args:
+            video_path: Path to the video file
+            bbox: (x, y, w, h) box around the object in the first frame
+            max_views: Maximum number of views to yield
+            min_difference: Minimum thumbnail difference (0-255) to keep a frame
+
+        Yields:
+            Tuples (frame_index, frame, bbox) of the kept views
+        """
+        cap = cv2.VideoCapture(video_path)
+        tracker = None
+        thumbnails = []
+        frame_index = -1
+
+        try:
+            while cap.isOpened() and len(thumbnails) < max_views:
+                ret, frame = cap.read()
+                if not ret:
+                    break
+                frame_index += 1
+
+                if tracker is None:
+                    # The tracker needs a non-empty box inside the frame to start from
+                    box = _clamp_box(bbox, frame.shape)
+                    if box is None:
+                        print(f"⚠ Bounding box {list(bbox)} is outside the video frame")
+                        break
+                    tracker = cv2.TrackerCSRT_create()
+                    tracker.init(frame, box)
+                else:
+                    success, box = tracker.update(frame)
+                    if not success:
+                        print(f"⚠ Tracker lost object at frame {frame_index}")
+                        break
+                    # The tracker box can leave the frame, clamp it so SAM2 is
+                    # prompted inside
+                    box = _clamp_box(box, frame.shape)
+                    if box is None:
+                        continue
+
+                x, y, w, h = box
+                crop = frame[y : y + h, x : x + w]
+                thumb = cv2.resize(
+                    cv2.cvtColor(crop, cv2.COLOR_BGR2GRAY), (32, 32)
+                ).astype(np.float32)
+
+                if all(np.abs(thumb - t).mean() >= min_difference for t in thumbnails):
+                    thumbnails.append(thumb)
+                    yield frame_index, frame, box
+        finally:
+            cap.release()
+
+    def _bbox_from_mask(self, mask):
+        """Bounding box of the 90% of mask pixels closest to the mask centroid.
+
+        Works on the mask's bounding region with row/column projections instead of
+        materializing a coordinate array for every mask pixel.
+
+        Returns:
+            List [x, y, w, h] or None if the mask is empty
+        """
+        rows = np.flatnonzero(mask.any(axis=1))
+        cols = np.flatnonzero(mask.any(axis=0))
+        if len(rows) == 0 or len(cols) == 0:
+            return None
+
+        y0, y1 = rows[0], rows[-1] + 1
+        x0, x1 = cols[0], cols[-1] + 1
+        region = mask[y0:y1, x0:x1]
+
+        # Centroid from the row/column pixel counts
+        ys = np.arange(y0, y1, dtype=np.float32)
+        xs = np.arange(x0, x1, dtype=np.float32)
+        row_counts = region.sum(axis=1)
+        col_counts = region.sum(axis=0)
+        num_pixels = row_counts.sum()
+        cy = (row_counts * ys).sum() / num_pixels
+        cx = (col_counts * xs).sum() / num_pixels
+
+        # Filter outliers: keep only the points within the 90th percentile distance
+        dist_sq = (ys - cy)[:, None] ** 2 + (xs - cx)[None, :] ** 2
+        threshold = np.percentile(dist_sq[region], 90)
+        kept = region & (dist_sq <= threshold)
+
+        kept_rows = np.flatnonzero(kept.any(axis=1))
+        kept_cols = np.flatnonzero(kept.any(axis=0))
+        if len(kept_rows) > 0 and len(kept_cols) > 0:
+            y_min, y_max = y0 + kept_rows[0], y0 + kept_rows[-1]
+            x_min, x_max = x0 + kept_cols[0], x0 + kept_cols[-1]
+        else:
+            y_min, y_max = y0, y1 - 1
+            x_min, x_max = x0, x1 - 1
+
+        return [int(x_min), int(y_min), int(x_max - x_min), int(y_max - y_min)]
+
+    def render_segmentation(self, frame, mask, bbox, center_x, center_y):
+        """Draws the mask, bounding box and click point onto a copy of the frame."""
+        display_frame = frame.copy()
+
+        # Blend the mask pixels with semi-transparent green
+        display_frame[mask] = (
+            display_frame[mask] * 0.7 + np.array([0, 255, 0]) * 0.3
+        ).astype(np.uint8)
+
+        # Draw bounding box
+        x, y, w, h = bbox
+        cv2.rectangle(display_frame, (x, y), (x + w, y + h), (0, 255, 0), 2)
+
+        # Draw center point
+        cv2.circle(display_frame, (center_x, center_y), 5, (255, 0, 0), -1)
+        return display_frame
 
     def get_bounding_box_from_sam(
         self,
         frame,
         center_x,
         center_y,
-        save_result=True,
+        save_result=False,
         output_path="segmentation_result.png",
+        return_overlay=False,
     ):
         """Use SAM to segment object at center point and derive bounding box.
 
@@ -160,11 +400,14 @@ class ObjectScanner:
             frame: Input video frame (BGR)
             center_x: X coordinate of center point
             center_y: Y coordinate of center point
-            save_result: Whether to save visualization (default: False)
+            save_result: Whether to save visualization in the background (default: False)
             output_path: Path to save the result image (default: "segmentation_result.png")
+            return_overlay: Whether to also return the visualization (default: False)
 
         Returns:
-            Tuple (x, y, w, h) or None if segmentation fails
+            Tuple (x, y, w, h) or None if segmentation fails. With return_overlay,
+            a pair (bbox, overlay) where overlay is a Future resolving to PNG bytes,
+            or None if segmentation failed or the debug writer queue was full.
         """
         self.predictor.set_image(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
         pts = np.array([[center_x, center_y]])
@@ -175,49 +418,21 @@ class ObjectScanner:
         mask_bool = masks[0].astype(bool)
 
         # Derive bounding box from mask
-        y_idx, x_idx = np.where(mask_bool)
-        if len(y_idx) > 0 and len(x_idx) > 0:
-            # Filter outliers: Keep only 90% of points closest to the centroid
-            points = np.column_stack((x_idx, y_idx))
-            centroid = points.mean(axis=0)
-            distances = np.linalg.norm(points - centroid, axis=1)
-            threshold = np.percentile(distances, 90)
-
-            filtered_points = points[distances <= threshold]
-
-            if len(filtered_points) > 0:
-                x_min, y_min = filtered_points.min(axis=0)
-                x_max, y_max = filtered_points.max(axis=0)
-            else:
-                x_min, x_max = x_idx.min(), x_idx.max()
-                y_min, y_max = y_idx.min(), y_idx.max()
+        bbox = self._bbox_from_mask(mask_bool)
 
-            bbox = [int(x_min), int(y_min), int(x_max - x_min), int(y_max - y_min)]
-
-            # Save visualization if requested
-            if save_result:
-                display_frame = frame.copy()
-
-                # Overlay the mask with semi-transparent green
-                overlay = display_frame.copy()
-                overlay[mask_bool] = [0, 255, 0]  # Green color (BGR)
-                display_frame = cv2.addWeighted(display_frame, 0.7, overlay, 0.3, 0)
-
-                # Draw bounding box
-                cv2.rectangle(
-                    display_frame, (x_min, y_min), (x_max, y_max), (0, 255, 0), 2
-                )
-
-                # Draw center point
-                cv2.circle(display_frame, (center_x, center_y), 5, (255, 0, 0), -1)
-
-                # Save the result
-                cv2.imwrite(output_path, display_frame)
-                print(f"✓ Segmentation result saved to {output_path}")
-
-            return bbox
+        # Visualization is rendered only on request and encoded/saved off the request path
+        overlay = None
+        if bbox and (save_result or return_overlay):
+            display_frame = self.render_segmentation(
+                frame, mask_bool, bbox, center_x, center_y
+            )
+            overlay = self.debug_writer.submit(
+                display_frame, output_path if save_result else None
+            )
 
-        return None
+        if return_overlay:
+            return bbox, overlay
+        return bbox
 
     # Function to run the scanning process
     def run_scanning(self):
@@ -0,0 +1,395 @@
+import os
+import contextlib
+import multiprocessing as mp
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+from multiprocessing import shared_memory
+import numpy as np
+import torch
+from PIL import Image
+from .detector import ObjectDetector
+from .detector_personalized import ObjectRecognizer
+from .scanner import DB_VERSION_FILE, DB_VERSION_SAVING, ObjectScanner
+
+# Model held by the current worker process, created by _init_worker
+_model = None
+_db_folder = None
+_db_stamp = None
+# Barrier shared by the workers of a pool, so warmup returns once all are started
+_ready = None
+
+# Longest time a worker waits for another process to finish saving the database
+DB_SAVE_TIMEOUT = 5.0
+
+
+class SharedFrame:
+    """Copies a frame into a shared-memory block that worker processes attach to.
+
+    Only the block name, shape and dtype are pickled to the worker, not the pixels.
+    The block is unlinked when the context exits.
+    """
+
+    def __init__(self, array):
+        array = np.ascontiguousarray(array)
+        self.shm = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+        view = np.ndarray(array.shape, dtype=array.dtype, buffer=self.shm.buf)
+        view[:] = array
+        del view
+        self.spec = (self.shm.name, array.shape, array.dtype.str)
+
+    def __enter__(self):
+        return self.spec
+
+    def __exit__(self, *exc):
+        self.shm.close()
+        self.shm.unlink()
+
+
+def parse_cpu_list(value):
+    """Parses a CPU list like "0-3,8" into a list of CPU ids (None if empty)."""
+    if not value:
+        return None
+    cpus = []
+    for part in value.split(","):
+        if "-" in part:
+            start, end = part.split("-")
+            cpus.extend(range(int(start), int(end) + 1))
+        else:
+            cpus.append(int(part))
+    return cpus
+
+
+def default_threads(total_workers):
+    """torch threads per worker when the machine's CPUs are shared by all workers."""
+    return max(1, (os.cpu_count() or 1) // total_workers)
+
+
+# ---------- Worker process side ----------
+
+
+def _init_worker(model_cls, model_kwargs, cpus, threads, ready):
+    global _model, _db_folder, _ready
+    _ready = ready
+    if cpus and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cpus)
+    if threads:
+        torch.set_num_threads(threads)
+    # Read the version before loading, so a save during startup triggers a reload
+    _db_folder = model_kwargs.get("db_folder")
+    _mark_database_loaded()
+    _model = model_cls(**model_kwargs)
+
+
+def _database_stamp():
+    """Returns the database version, waiting for a save in progress to finish.
+
+    A version that stays "saving" (a save that failed part way) is only waited
+    for once, afterwards it is treated like any other version.
+    """
+    if _db_folder is None:
+        return None
+    version_path = os.path.join(_db_folder, DB_VERSION_FILE)
+    deadline = time.time() + DB_SAVE_TIMEOUT
+    while True:
+        if not os.path.exists(version_path):
+            return None
+        with open(version_path) as f:
+            stamp = f.read()
+        if stamp != DB_VERSION_SAVING or stamp == _db_stamp or time.time() > deadline:
+            return stamp
+        time.sleep(0.01)
+
+
+def _mark_database_loaded():
+    global _db_stamp
+    _db_stamp = _database_stamp()
+
+
+def _reload_if_stale():
+    """Reloads the FAISS database if another process saved it since the last load."""
+    global _db_stamp
+    stamp = _database_stamp()
+    while stamp != _db_stamp:
+        if isinstance(_model, ObjectScanner):
+            _model.load_or_create_database()
+        else:
+            _model._load_database()
+        _db_stamp = stamp
+        # A save that started while loading invalidates what was read, so check again
+        stamp = _database_stamp()
+
+
+def _run_on_frame(spec, fn):
+    name, shape, dtype = spec
+    shm = shared_memory.SharedMemory(name=name)
+    frame = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+    try:
+        return fn(frame)
+    finally:
+        del frame
+        try:
+            shm.close()
+        except BufferError:
+            # A model still references the frame, the mapping is released with it
+            pass
+
+
+def _ping():
+    # Each worker blocks here until every worker of the pool has loaded its model,
+    # so the pings cannot all be answered by the first worker that is ready
+    _ready.wait()
+    return os.getpid()
+
+
+def _detect(spec, prompt):
+    return _run_on_frame(
+        spec, lambda frame: _model.predict(Image.fromarray(frame), prompt)
+    )
+
+
+def _identify(spec, target_label, latency_budget_ms):
+    _reload_if_stale()
+    if latency_budget_ms:
+        return _run_on_frame(
+            spec,
+            lambda frame: _model.run_adaptive_identification_cycle(
+                frame, target_label, latency_budget_ms
+            ),
+        )
+    return _run_on_frame(
+        spec, lambda frame: _model.run_identification_cycle(frame, target_label)
+    )
+
+
+def _bounding_box(spec, center_x, center_y, return_overlay):
+    def run(frame):
+        if not return_overlay:
+            return _model.get_bounding_box_from_sam(frame, center_x, center_y), None
+        bbox, overlay = _model.get_bounding_box_from_sam(
+            frame, center_x, center_y, return_overlay=True
+        )
+        png = None
+        if overlay:
+            try:
+                png = overlay.result()
+            except Exception as e:
+                print(f"⚠ Debug overlay failed: {e}")
+        return bbox, png
+
+    return _run_on_frame(spec, run)
+
+
+def _embed_views(specs, bboxes):
+    frames, shms = [], []
+    for name, shape, dtype in specs:
+        shm = shared_memory.SharedMemory(name=name)
+        shms.append(shm)
+        frames.append(np.ndarray(shape, dtype=dtype, buffer=shm.buf))
+    try:
+        return _model.embed_views(frames, bboxes)
+    finally:
+        del frames
+        for shm in shms:
+            try:
+                shm.close()
+            except BufferError:
+                pass
+
+
+def _process_and_store(spec, bbox, label):
+    _reload_if_stale()
+    success = _run_on_frame(
+        spec, lambda frame: _model.process_and_store(frame, bbox, label)
+    )
+    if success:
+        _model.save_to_database()
+        _mark_database_loaded()
+    return success
+
+
+def _store_features(features, hists, label):
+    _reload_if_stale()
+    _model.store_features(features, hists, label)
+    _model.save_to_database()
+    _mark_database_loaded()
+
+
+def _delete_object(label):
+    _reload_if_stale()
+    success = _model.delete_object(label)
+    _mark_database_loaded()
+    return success
+
+
+def _object_summary():
+    _reload_if_stale()
+    return _model.get_object_summary()
+
+
+# ---------- API process side ----------
+
+
+class ModelWorkerPool:
+    """Pool of worker processes that each hold one instance of a model class.
+
+    Args:
+        model_cls: ObjectDetector, ObjectRecognizer or ObjectScanner
+        model_kwargs: Constructor arguments for the model
+        size: Number of worker processes
+        cpus: Optional list of CPU ids the workers are pinned to
+        threads: torch intra-op threads per worker (default: CPUs per worker if
+            cpus is given, otherwise torch's default of one thread per core)
+    """
+
+    def __init__(self, model_cls, model_kwargs, size=1, cpus=None, threads=None):
+        if threads is None and cpus:
+            threads = max(1, len(cpus) // size)
+        self.size = size
+        context = mp.get_context("spawn")
+        self.executor = ProcessPoolExecutor(
+            max_workers=size,
+            mp_context=context,
+            initializer=_init_worker,
+            initargs=(model_cls, model_kwargs, cpus, threads, context.Barrier(size)),
+        )
+
+    def call(self, fn, *args):
+        return self.executor.submit(fn, *args).result()
+
+    def call_on_frame(self, fn, frame, *args):
+        with SharedFrame(frame) as spec:
+            return self.call(fn, spec, *args)
+
+    def warmup(self):
+        """Waits until every worker has loaded its model and returns their PIDs."""
+        futures = [self.executor.submit(_ping) for _ in range(self.size)]
+        return sorted({f.result() for f in futures})
+
+    def shutdown(self):
+        self.executor.shutdown(wait=True)
+
+
+class ObjectDetectorPool(ModelWorkerPool):
+    """Runs ObjectDetector.predict in worker processes."""
+
+    def __init__(self, model_path, **pool_kwargs):
+        super().__init__(ObjectDetector, {"model_path": model_path}, **pool_kwargs)
+
+    def predict(self, image, prompt):
+        return self.call_on_frame(_detect, np.asarray(image.convert("RGB")), prompt)
+
+
+class ObjectRecognizerPool(ModelWorkerPool):
+    """Runs ObjectRecognizer identification cycles in worker processes.
+
+    Workers reload the FAISS database on their own when it was saved by another process.
+    """
+
+    def __init__(self, db_folder="faiss_db", device=None, **pool_kwargs):
+        super().__init__(
+            ObjectRecognizer, {"db_folder": db_folder, "device": device}, **pool_kwargs
+        )
+
+    def run_identification_cycle(self, frame, target_label):
+        return self.call_on_frame(_identify, frame, target_label, None)
+
+    def run_adaptive_identification_cycle(self, frame, target_label, latency_budget_ms):
+        return self.call_on_frame(_identify, frame, target_label, latency_budget_ms)
+
+    def _load_database(self):
+        # Workers pick up database changes before their next cycle
+        pass
+
+
+class ObjectScannerPool(ModelWorkerPool):
+    """Runs ObjectScanner segmentation and enrollment in worker processes.
+
+    Calls that change the database are serialized and saved right away, so every
+    worker sees the same database after reloading it.
+    """
+
+    def __init__(self, db_folder="faiss_db", device=None, **pool_kwargs):
+        super().__init__(
+            ObjectScanner, {"db_folder": db_folder, "device": device}, **pool_kwargs
+        )
+        self.write_lock = threading.Lock()
+
+    sample_video_views = staticmethod(ObjectScanner.sample_video_views)
+
+    def get_bounding_box_from_sam(
+        self, frame, center_x, center_y, return_overlay=False
+    ):
+        bbox, png = self.call_on_frame(
+            _bounding_box, frame, center_x, center_y, return_overlay
+        )
+        if not return_overlay:
+            return bbox
+
+        # Same (bbox, Future) contract as ObjectScanner
+        overlay = None
+        if png is not None:
+            overlay = Future()
+            overlay.set_result(png)
+        return bbox, overlay
+
+    def embed_views(self, frames, bboxes):
+        with contextlib.ExitStack() as stack:
+            specs = [stack.enter_context(SharedFrame(frame)) for frame in frames]
+            return self.call(_embed_views, specs, bboxes)
+
+    def process_and_store(self, frame, bbox, label):
+        with self.write_lock:
+            return self.call_on_frame(_process_and_store, frame, bbox, label)
+
+    def store_features(self, features, hists, label):
+        with self.write_lock:
+            self.call(_store_features, features, hists, label)
+
+    def save_to_database(self):
+        # Workers save right after every change
+        pass
+
+    def delete_object(self, label):
+        with self.write_lock:
+            return self.call(_delete_object, label)
+
+    def get_object_summary(self):
+        return self.call(_object_summary)
+
+
+def create_worker_pools(
+    yolo_model_path="models/yolov8s-world.pt", db_folder="faiss_db"
+):
+    """Creates the detector, recognizer and scanner pools from environment variables.
+
+    For each pool prefix (DETECTOR, RECOGNIZER, SCANNER):
+        <PREFIX>_WORKERS: number of worker processes (default: 1)
+        <PREFIX>_CPUS: CPU list the workers are pinned to, e.g. "0-3" (default: all)
+        <PREFIX>_THREADS: torch threads per worker (default: CPUs per worker, or
+            the machine's CPUs split evenly across all workers if unpinned)
+    """
+
+    prefixes = ["DETECTOR", "RECOGNIZER", "SCANNER"]
+    total_workers = sum(int(os.environ.get(f"{p}_WORKERS", "1")) for p in prefixes)
+
+    def pool_kwargs(prefix):
+        size = int(os.environ.get(f"{prefix}_WORKERS", "1"))
+        cpus = parse_cpu_list(os.environ.get(f"{prefix}_CPUS"))
+        threads = os.environ.get(f"{prefix}_THREADS")
+        if threads:
+            threads = int(threads)
+        elif not cpus:
+            # Unpinned workers split the machine, instead of each using every core
+            threads = default_threads(total_workers)
+        return {"size": size, "cpus": cpus, "threads": threads}
+
+    pools = (
+        ObjectDetectorPool(yolo_model_path, **pool_kwargs(prefixes[0])),
+        ObjectRecognizerPool(db_folder=db_folder, **pool_kwargs(prefixes[1])),
+        ObjectScannerPool(db_folder=db_folder, **pool_kwargs(prefixes[2])),
+    )
+    for pool in pools:
+        pids = pool.warmup()
+        print(f"✓ {type(pool).__name__} ready ({len(pids)} worker(s): {pids})")
+    return pools